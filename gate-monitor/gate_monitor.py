@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 """Gate Monitor - Detect gate status using Gemini Vision API."""
 
+import hashlib
 import json
+import os
+import queue
+import random
 import re
+import signal
 import sys
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
@@ -12,21 +18,48 @@ import cv2
 import numpy as np
 import paho.mqtt.client as mqtt
 from google import genai
-from google.genai import types
-from PIL import Image
-import io
+from google.genai import errors, types
+
+# orjson is installed where wheels exist (amd64/aarch64); both variants return
+# bytes, which paho publishes as-is
+try:
+    from orjson import dumps as _dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+# libjpeg-turbo bindings are optional; fall back to OpenCV's encoder without them
+try:
+    from turbojpeg import TJSAMP_420, TurboJPEG
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbojpeg = None
 
 # Enable unbuffered output for real-time logging
 sys.stdout.reconfigure(line_buffering=True)
 
+# RTSP over TCP: no UDP packet loss smearing frames; must be set before any VideoCapture
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;tcp")
+
 VERSION = "1.3.3"
 CONFIG_PATH = Path("/data/options.json")
 SNAPSHOT_DIR = Path("/config/www/gate-monitor")
 REFERENCE_DIR = Path("/config/www/gate-monitor/reference")
+MODEL_CACHE_PATH = Path("/data/model_cache.json")
+SNAPSHOT_INDEX_PATH = Path("/data/snapshot_index.json")
+
+# Number of alert snapshots kept per camera (ring buffer)
+SNAPSHOT_HISTORY = 50
+
+# How long the ranked model list is reused across restarts (seconds)
+MODEL_CACHE_TTL = 7 * 24 * 3600
 
 # Model variants unsuitable for vision tasks
 EXCLUDED_MODEL_SUFFIXES = ["-tts", "-lite", "-thinking", "-search", "-live", "-image", "-customtools", "-audio", "-embedding", "-robotics", "-computer-use"]
 
+# Matches a name containing any excluded suffix, either at the end or followed by "-"
+_EXCLUDED_MODEL_RE = re.compile("(?:" + "|".join(map(re.escape, EXCLUDED_MODEL_SUFFIXES)) + ")(?:-|$)")
+
 # Minimum Gemini model version to use (lower versions give unreliable results)
 MIN_MODEL_VERSION = 3.0
 
@@ -36,6 +69,12 @@ SSIM_THRESHOLD = 0.85
 # Saturation threshold to distinguish day (color) from night (B&W/IR)
 NIGHT_SATURATION_THRESHOLD = 30
 
+# Static scene detection: thumbnail size (w, h) and the mean absolute
+# grayscale difference below which the gate crop is considered unchanged
+# since the last analyzed check
+SCENE_THUMB_SIZE = (64, 48)
+SCENE_CHANGE_THRESHOLD = 4.0
+
 VISION_PROMPT_WITH_REFS = """You are a gate status classifier. Your task is to determine if a gate is OPEN or CLOSED by comparing the query image against the reference examples provided.
 
 INSTRUCTIONS:
@@ -61,6 +100,31 @@ Respond ONLY with valid JSON (no markdown, no extra text):
 {"status": "CLOSED", "confidence": 95}
 {"status": "UNKNOWN", "confidence": 30}"""
 
+# Constrained decoding: Gemini must answer with exactly this JSON shape, so the
+# output is short and parse_gate_response() takes its bare-JSON fast path
+GATE_RESPONSE_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "status": types.Schema(type=types.Type.STRING, enum=["OPEN", "CLOSED", "UNKNOWN"]),
+        "confidence": types.Schema(type=types.Type.INTEGER, minimum=0, maximum=100),
+    },
+    required=["status", "confidence"],
+    property_ordering=["status", "confidence"],
+)
+
+GENERATION_CONFIG = types.GenerateContentConfig(
+    temperature=0.0,
+    response_mime_type="application/json",
+    response_schema=GATE_RESPONSE_SCHEMA,
+)
+
+# Patterns for extracting JSON from Gemini responses
+_FENCE_OPEN = re.compile(r'^```(?:json)?\s*', re.MULTILINE)
+_FENCE_CLOSE = re.compile(r'\s*```$', re.MULTILINE)
+_RETRY_DELAY = re.compile(r'^(\d+(?:\.\d+)?)s$')
+_RETRY_IN_MESSAGE = re.compile(r'retry in (\d+(?:\.\d+)?)s', re.IGNORECASE)
+_JSON_FALLBACK = re.compile(r'\{[^}]*"status"\s*:\s*"(OPEN|CLOSED|UNKNOWN)"[^}]*\}', re.IGNORECASE)
+
 # Gate region crop coordinates (percentage of frame)
 # Based on camera view: gate is in upper-left corner
 GATE_CROP = {
@@ -70,6 +134,48 @@ GATE_CROP = {
     "y_end": 0.55,     # 55% from top
 }
 
+# Nominal frame size: snapshots are saved at this size, and the gate crop is
+# resized to the dimensions it would have inside a frame of this size
+FRAME_SIZE = (640, 480)
+
+# Longest edge (px) of any image sent to Gemini; image size drives upload
+# bytes, vision tokens and latency, and the gate crop needs far less detail
+MAX_VISION_EDGE = 512
+
+# JPEG quality for the gate crop and reference images sent to Gemini; both use
+# the same encoding so the model compares like with like
+VISION_JPEG_QUALITY = 90
+
+# Background RTSP reader: convert every Nth grabbed frame to BGR for motion
+# detection, reconnect delay after a stream failure, and max wait for a frame
+CAPTURE_RETRIEVE_EVERY = 10
+CAPTURE_RECONNECT_SECONDS = 10
+CAPTURE_FRAME_TIMEOUT = 15
+
+# Gemini retries: HTTP codes retried on the same model, retries per model, and
+# exponential backoff bounds (seconds) between retries
+TRANSIENT_ERROR_CODES = (503, 504)
+TRANSIENT_RETRIES = 2
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+# Longest server-requested retry delay (seconds) honored on a 429 before
+# falling back to the next model instead (per-minute quotas reset quickly,
+# daily quotas do not)
+RATE_LIMIT_MAX_WAIT_SECONDS = 60.0
+
+# Max seconds to block waiting for the broker to acknowledge a QoS 1 publish,
+# and for the initial broker connection at startup
+MQTT_PUBLISH_TIMEOUT = 5
+MQTT_CONNECT_TIMEOUT = 10
+
+# Motion trigger: per-pixel grayscale delta and number of changed thumbnail
+# pixels (of SCENE_THUMB_SIZE) between sampled frames that count as motion,
+# and seconds the scene must be still again before the check is requested
+MOTION_PIXEL_DELTA = 25
+MOTION_MIN_PIXELS = 150
+MOTION_SETTLE_SECONDS = 3
+
 # Reference image filenames to look for
 REFERENCE_FILENAMES = [
     "closed_day.jpg",
@@ -87,18 +193,25 @@ def log(module: str, message: str) -> None:
 def load_config() -> dict:
     """Load configuration from Home Assistant options."""
     if CONFIG_PATH.exists():
-        with open(CONFIG_PATH) as f:
-            return json.load(f)
+        return json.loads(CONFIG_PATH.read_bytes())
     log("config", "Config file not found, using defaults")
     return {}
 
 
+def fit_vision_budget(width: int, height: int) -> tuple[int, int]:
+    """Scale (width, height) down, keeping aspect ratio, so the longest edge fits MAX_VISION_EDGE."""
+    scale = MAX_VISION_EDGE / max(width, height)
+    if scale >= 1:
+        return width, height
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
 def load_reference_images() -> dict:
     """Load reference images from the reference directory.
 
     Returns a dict with structure:
     {
-        "pil": [(label, PIL.Image), ...],  -- for Gemini few-shot prompting
+        "jpeg": [(label, bytes), ...],      -- for Gemini few-shot prompting
         "cv": {                             -- for local SSIM comparison
             "closed_day": np.ndarray | None,
             "closed_night": np.ndarray | None,
@@ -108,7 +221,7 @@ def load_reference_images() -> dict:
     }
     """
     result = {
-        "pil": [],
+        "jpeg": [],
         "cv": {"closed_day": None, "closed_night": None, "open_day": None, "open_night": None},
     }
 
@@ -128,32 +241,30 @@ def load_reference_images() -> dict:
         filepath = REFERENCE_DIR / filename
         if filepath.exists():
             try:
-                # Load PIL version for Gemini
-                img = Image.open(filepath)
-                img.load()
-                w, h = img.size
-                crop_box = (
-                    int(w * GATE_CROP["x_start"]),
-                    int(h * GATE_CROP["y_start"]),
-                    int(w * GATE_CROP["x_end"]),
-                    int(h * GATE_CROP["y_end"]),
-                )
-                img = img.crop(crop_box)
-                label = label_map[filename]
-                result["pil"].append((label, img))
-
-                # Load OpenCV version for SSIM
-                cv_img = cv2.imread(str(filepath))
+                # Decode once with OpenCV; both the SSIM and Gemini versions derive from it
+                cv_img = cv2.imdecode(np.frombuffer(filepath.read_bytes(), np.uint8), cv2.IMREAD_COLOR)
+                if cv_img is None:
+                    raise ValueError("not a decodable image")
                 height, width = cv_img.shape[:2]
                 x1 = int(width * GATE_CROP["x_start"])
                 x2 = int(width * GATE_CROP["x_end"])
                 y1 = int(height * GATE_CROP["y_start"])
                 y2 = int(height * GATE_CROP["y_end"])
                 cv_cropped = cv_img[y1:y2, x1:x2]
+
+                # OpenCV grayscale version for SSIM
                 cv_gray = cv2.cvtColor(cv_cropped, cv2.COLOR_BGR2GRAY)
                 key = filename.replace(".jpg", "")
                 result["cv"][key] = cv_gray
-                log("reference", f"Loaded: {filename} (cropped to {img.size[0]}x{img.size[1]})")
+
+                # JPEG version for Gemini, within the vision budget and encoded once;
+                # resizing the crop view yields the contiguous buffer the encoder wants
+                crop_h, crop_w = cv_cropped.shape[:2]
+                crop_w, crop_h = fit_vision_budget(crop_w, crop_h)
+                cv_cropped = cv2.resize(cv_cropped, (crop_w, crop_h), interpolation=cv2.INTER_AREA)
+                label = label_map[filename]
+                result["jpeg"].append((label, encode_jpeg(cv_cropped, VISION_JPEG_QUALITY)))
+                log("reference", f"Loaded: {filename} (cropped to {crop_w}x{crop_h})")
             except Exception as e:
                 log("reference", f"ERROR loading {filename}: {e}")
         else:
@@ -161,7 +272,7 @@ def load_reference_images() -> dict:
 
     loaded_count = sum(1 for v in result["cv"].values() if v is not None)
     if loaded_count > 0:
-        log("reference", f"Loaded {loaded_count} reference images (PIL + OpenCV)")
+        log("reference", f"Loaded {loaded_count} reference images (JPEG + OpenCV)")
     else:
         log("reference", "No reference images found, running in zero-shot mode")
 
@@ -257,6 +368,21 @@ def compare_local(gate_crop_bgr: np.ndarray, reference_images: dict, threshold:
     return "inconclusive", scores[best_status]
 
 
+def scene_thumbnail(gate_crop_bgr: np.ndarray) -> np.ndarray:
+    """Downscale the gate crop to a small grayscale thumbnail for change detection."""
+    thumb = cv2.resize(gate_crop_bgr, SCENE_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+
+
+def is_scene_unchanged(thumb: np.ndarray, last_thumb: np.ndarray | None, threshold: float = SCENE_CHANGE_THRESHOLD) -> bool:
+    """Check whether the gate thumbnail matches the last analyzed one (mean absolute difference below threshold)."""
+    if last_thumb is None:
+        return False
+    delta = float(cv2.absdiff(thumb, last_thumb).mean())
+    log("opencv", f"Scene change vs last analyzed check: {delta:.2f} (threshold {threshold})")
+    return delta < threshold
+
+
 def _parse_model_version(name: str) -> tuple[float, int, int]:
     """Extract sorting key from model name: (version, type_rank, stability_rank).
 
@@ -276,11 +402,58 @@ def _parse_model_version(name: str) -> tuple[float, int, int]:
     return (version, type_rank, stability_rank)
 
 
-def find_available_models(client: genai.Client) -> list[str]:
+def model_cache_key(api_key: str) -> str:
+    """Identify the API key and model filter rules a cached list was built for."""
+    rules = f"{api_key}|{MIN_MODEL_VERSION}|{'|'.join(EXCLUDED_MODEL_SUFFIXES)}"
+    return hashlib.sha256(rules.encode()).hexdigest()[:16]
+
+
+def load_model_cache(cache_key: str) -> list[str] | None:
+    """Return the cached ranked model list, or None if missing, unreadable, expired or built for another key."""
+    try:
+        data = json.loads(MODEL_CACHE_PATH.read_bytes())
+        age = time.time() - data["ts"]
+        models = data["models"]
+        key = data["key"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    if key != cache_key or age >= MODEL_CACHE_TTL or not models:
+        return None
+    log("models", f"Using cached model list ({int(age // 3600)}h old)")
+    return models
+
+
+def save_model_cache(cache_key: str, models: list[str]) -> None:
+    """Persist the ranked model list so restarts can skip listing models."""
+    tmp_path = MODEL_CACHE_PATH.with_suffix(".json.tmp")
+    try:
+        tmp_path.write_text(json.dumps({"key": cache_key, "models": models, "ts": time.time()}))
+        os.replace(tmp_path, MODEL_CACHE_PATH)
+    except OSError as e:
+        log("models", f"ERROR saving model cache: {e}")
+
+
+def invalidate_model_cache() -> None:
+    """Drop the cached model list so the next startup lists models again."""
+    try:
+        MODEL_CACHE_PATH.unlink(missing_ok=True)
+    except OSError as e:
+        log("models", f"ERROR removing model cache: {e}")
+
+
+def find_available_models(client: genai.Client, cache_key: str) -> list[str]:
     """List available models and return them sorted by version descending.
 
     Filters out models unsuitable for vision and below MIN_MODEL_VERSION.
+    A ranked list cached for the same cache_key within MODEL_CACHE_TTL is
+    returned without an API call.
     """
+    cached = load_model_cache(cache_key)
+    if cached is not None:
+        log("models", f"Ranked 3.x+ models ({len(cached)}): {', '.join(cached[:5])}{'...' if len(cached) > 5 else ''}")
+        return cached
+
     log("models", "Listing available Gemini models...")
 
     available_models = []
@@ -298,97 +471,299 @@ def find_available_models(client: genai.Client) -> list[str]:
 
     log("models", f"Found {len(available_models)} Gemini models from API")
 
-    # Filter out models unsuitable for vision tasks
-    filtered = []
+    # Filter out models unsuitable for vision tasks, parsing each name once
+    ranked = []
     for name in available_models:
-        lower = name.lower()
-        if any(lower.endswith(suffix) or suffix + "-" in lower for suffix in EXCLUDED_MODEL_SUFFIXES):
+        if _EXCLUDED_MODEL_RE.search(name.lower()):
             log("models", f"  Excluded (not vision): {name}")
             continue
 
         # Enforce minimum version
-        version_match = re.search(r'gemini-(\d+(?:\.\d+)?)', name)
-        version = float(version_match.group(1)) if version_match else 0.0
+        version, type_rank, stability_rank = _parse_model_version(name)
         if version < MIN_MODEL_VERSION:
             log("models", f"  Excluded (v{version} < {MIN_MODEL_VERSION}): {name}")
             continue
 
-        filtered.append(name)
+        # Sort key: flash before pro (free tier), then highest version, then stable before preview
+        ranked.append(((type_rank, -version, stability_rank), name))
 
-    # Sort: flash before pro (free tier), then highest version, then stable before preview
-    filtered.sort(key=lambda n: (_parse_model_version(n)[1], -_parse_model_version(n)[0], _parse_model_version(n)[2]))
+    # Sort on the key only: stable, so equal-rank models keep the API's listing order
+    ranked.sort(key=lambda item: item[0])
+    filtered = [name for _, name in ranked]
 
     if filtered:
         log("models", f"Ranked 3.x+ models ({len(filtered)}): {', '.join(filtered[:5])}{'...' if len(filtered) > 5 else ''}")
+        save_model_cache(cache_key, filtered)
     else:
         log("models", "WARNING: No Gemini 3.x+ models found! Will rely on local comparison only.")
 
     return filtered
 
 
-def capture_rtsp_frame(rtsp_url: str) -> tuple[bytes, bytes, np.ndarray] | tuple[None, None, None]:
-    """Capture a single frame from RTSP stream.
+class RTSPCapture:
+    """Keep an RTSP stream open in a background thread and serve its newest frame.
 
-    Returns:
-        Tuple of (full_frame_bytes, cropped_gate_bytes, cropped_gate_bgr) or (None, None, None)
+    The reader thread only grab()s, which keeps FFmpeg's buffer drained so the
+    stream never lags, and checks never pay the RTSP handshake. The costly BGR
+    conversion (retrieve()) runs only when latest() is called, plus on every
+    CAPTURE_RETRIEVE_EVERY-th frame when motion detection is on. In that mode
+    the gate region is diffed between samples; once motion has been seen and
+    the scene settles, a "motion" check is requested, at most once per cooldown.
     """
-    log("camera", "Capturing frame from camera...")
-
-    cap = cv2.VideoCapture(rtsp_url)
-    if not cap.isOpened():
-        log("camera", "ERROR: Failed to open RTSP stream")
-        return None, None, None
 
-    ret, frame = cap.read()
-    cap.release()
+    def __init__(self, rtsp_url: str, check_requests: queue.Queue | None = None, motion_cooldown: float = 0) -> None:
+        self._url = rtsp_url
+        self._check_requests = check_requests
+        self._motion_cooldown = motion_cooldown
+        self._motion_seen_at: float | None = None
+        self._last_request = float("-inf")
+        # Guards _cap: VideoCapture is not thread-safe
+        self._lock = threading.Lock()
+        self._cap: cv2.VideoCapture | None = None
+        self._has_frame = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._reader, name="rtsp-reader", daemon=True)
+
+    def start(self) -> None:
+        """Start the background reader thread."""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Signal the reader thread to release the stream and exit."""
+        self._stopped.set()
+        self._thread.join(timeout=5)
+
+    def latest(self, timeout: float = CAPTURE_FRAME_TIMEOUT) -> np.ndarray | None:
+        """Decode and return the most recently grabbed BGR frame, waiting up to `timeout` seconds for one."""
+        if not self._has_frame.wait(timeout):
+            return None
+        with self._lock:
+            if self._cap is None:
+                return None
+            ret, frame = self._cap.retrieve()
+        return frame if ret else None
+
+    def _open(self) -> cv2.VideoCapture | None:
+        # Let FFmpeg use a hardware decoder when the platform has one
+        cap = cv2.VideoCapture(
+            self._url, cv2.CAP_FFMPEG,
+            [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY],
+        )
+        if not cap.isOpened():
+            log("camera", "ERROR: Failed to open RTSP stream")
+            cap.release()
+            return None
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        hw_accel = int(cap.get(cv2.CAP_PROP_HW_ACCELERATION))
+        log("camera", f"RTSP stream opened ({'hardware' if hw_accel != cv2.VIDEO_ACCELERATION_NONE else 'software'} decode)")
+        return cap
+
+    def _reader(self) -> None:
+        while not self._stopped.is_set():
+            cap = self._open()
+            if cap is None:
+                self._stopped.wait(CAPTURE_RECONNECT_SECONDS)
+                continue
+            with self._lock:
+                self._cap = cap
+
+            grabbed = 0
+            prev_thumb = None
+            while not self._stopped.is_set():
+                frame = None
+                with self._lock:
+                    if not cap.grab():
+                        log("camera", f"ERROR: Stream read failed, reconnecting in {CAPTURE_RECONNECT_SECONDS}s")
+                        break
+                    grabbed += 1
+                    if self._check_requests is not None and (grabbed - 1) % CAPTURE_RETRIEVE_EVERY == 0:
+                        ret, frame = cap.retrieve()
+                        if not ret:
+                            frame = None
+                self._has_frame.set()
+                if frame is not None:
+                    prev_thumb = self._detect_motion(frame, prev_thumb)
+
+            # Never hand out a frame from a dead stream
+            self._has_frame.clear()
+            with self._lock:
+                self._cap = None
+                cap.release()
+            self._stopped.wait(CAPTURE_RECONNECT_SECONDS)
+
+    def _detect_motion(self, frame: np.ndarray, prev_thumb: np.ndarray | None) -> np.ndarray:
+        """Track motion in the gate region and request a check once it settles; return the new thumbnail."""
+        thumb = scene_thumbnail(crop_gate(frame))
+        if prev_thumb is None:
+            return thumb
+
+        diff = cv2.absdiff(thumb, prev_thumb)
+        _, mask = cv2.threshold(diff, MOTION_PIXEL_DELTA, 255, cv2.THRESH_BINARY)
+        changed = cv2.countNonZero(mask)
+        now = time.monotonic()
+
+        if changed > MOTION_MIN_PIXELS:
+            if self._motion_seen_at is None:
+                log("camera", f"Motion in gate region ({changed} px changed)")
+            self._motion_seen_at = now
+        elif (
+            self._motion_seen_at is not None
+            and now - self._motion_seen_at >= MOTION_SETTLE_SECONDS
+            and now - self._last_request >= self._motion_cooldown
+        ):
+            self._motion_seen_at = None
+            self._last_request = now
+            log("camera", "Gate region settled after motion, requesting check")
+            try:
+                self._check_requests.put_nowait("motion")
+            except queue.Full:
+                pass
+        return thumb
 
-    if not ret:
-        log("camera", "ERROR: Failed to capture frame")
-        return None, None, None
 
-    frame = cv2.resize(frame, (640, 480))
-    height, width = frame.shape[:2]
+def wait_for_check(check_requests: queue.Queue, check_interval: int) -> str:
+    """Block until a check is requested or the check interval elapses; return the reason."""
+    try:
+        return check_requests.get(timeout=check_interval)
+    except queue.Empty:
+        return "interval"
 
-    _, full_buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
 
+def crop_gate(frame: np.ndarray) -> np.ndarray:
+    """Return the GATE_CROP region of a frame at its native resolution (a view, not a copy)."""
+    height, width = frame.shape[:2]
     x1 = int(width * GATE_CROP["x_start"])
     x2 = int(width * GATE_CROP["x_end"])
     y1 = int(height * GATE_CROP["y_start"])
     y2 = int(height * GATE_CROP["y_end"])
+    return frame[y1:y2, x1:x2]
+
+
+def encode_jpeg(image_bgr: np.ndarray, quality: int) -> bytes:
+    """JPEG-encode a BGR image, using libjpeg-turbo directly when available.
+
+    The OpenCV fallback builds optimized Huffman tables (~10% smaller, same pixels).
+    """
+    global _turbojpeg
+    if _turbojpeg is not None:
+        try:
+            return _turbojpeg.encode(image_bgr, quality=quality, jpeg_subsample=TJSAMP_420)
+        except Exception as e:
+            # A library that loads but fails to encode must not cost us snapshots
+            log("camera", f"WARNING: libjpeg-turbo encode failed ({e}), switching to OpenCV encoder")
+            _turbojpeg = None
+    _, buffer = cv2.imencode('.jpg', image_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    return buffer.tobytes()
+
+
+def capture_rtsp_frame(capture: RTSPCapture) -> tuple[np.ndarray, bytes, np.ndarray] | tuple[None, None, None]:
+    """Take the latest frame from the background RTSP reader and crop the gate.
+
+    Only the gate crop is JPEG-encoded here; the full frame is returned raw and
+    encoded by Snapshotter.save() when an alert actually needs it.
+
+    Returns:
+        Tuple of (full_frame_bgr, cropped_gate_bytes, cropped_gate_bgr) or (None, None, None)
+    """
+    log("camera", "Capturing frame from camera...")
+
+    frame = capture.latest()
+    if frame is None:
+        log("camera", "ERROR: No frame available from RTSP stream")
+        return None, None, None
 
-    cropped = frame[y1:y2, x1:x2]
-    _, crop_buffer = cv2.imencode('.jpg', cropped, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    frame_w, frame_h = FRAME_SIZE
+    crop_w = int(frame_w * GATE_CROP["x_end"]) - int(frame_w * GATE_CROP["x_start"])
+    crop_h = int(frame_h * GATE_CROP["y_end"]) - int(frame_h * GATE_CROP["y_start"])
+    crop_w, crop_h = fit_vision_budget(crop_w, crop_h)
 
-    log("camera", f"Frame captured: full 640x480, gate crop {x2-x1}x{y2-y1}")
-    return full_buffer.tobytes(), crop_buffer.tobytes(), cropped
+    # Crop at native resolution, then a single resize to the final size: only the
+    # gate region is resampled and the result is contiguous for the JPEG encoder
+    gate_view = crop_gate(frame)
+    native_h, native_w = gate_view.shape[:2]
+    cropped = cv2.resize(gate_view, (crop_w, crop_h), interpolation=cv2.INTER_AREA)
+    crop_data = encode_jpeg(cropped, VISION_JPEG_QUALITY)
 
+    height, width = frame.shape[:2]
+    log("camera", f"Frame captured: full {width}x{height}, gate crop {native_w}x{native_h} -> {crop_w}x{crop_h}")
+    return frame, crop_data, cropped
 
-def save_snapshot(image_data: bytes, camera_name: str) -> str | None:
-    """Save snapshot to /media/gate-monitor/ and return the path."""
+
+def write_file(path: Path, data: bytes) -> None:
+    """Write a small blob with a single unbuffered os.write (looping only on short writes)."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
     try:
-        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
 
-        # Save with timestamp for history
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        snapshot_path = SNAPSHOT_DIR / f"{camera_name}_{timestamp}.jpg"
+class Snapshotter:
+    """Save alert snapshots into a fixed ring of `history` files per camera.
 
-        with open(snapshot_path, "wb") as f:
-            f.write(image_data)
+    Files are named {camera_name}_000.jpg ... so disk use stays bounded; the
+    next slot index is persisted in SNAPSHOT_INDEX_PATH across restarts.
+    """
 
-        # Also save as "latest" for easy access
-        latest_path = SNAPSHOT_DIR / f"{camera_name}_latest.jpg"
-        with open(latest_path, "wb") as f:
-            f.write(image_data)
+    def __init__(self, camera_name: str, history: int = SNAPSHOT_HISTORY) -> None:
+        self._camera_name = camera_name
+        self._history = history
+        self._idx = self._load_index()
 
-        log("snapshot", f"Saved snapshot to {snapshot_path}")
+    def _load_index(self) -> int:
+        try:
+            return int(json.loads(SNAPSHOT_INDEX_PATH.read_bytes())[self._camera_name])
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
 
-        # Return /local/ path for HA notifications (maps to /config/www/)
-        timestamp_url = int(datetime.now().timestamp())
-        return f"/local/gate-monitor/{camera_name}_latest.jpg?v={timestamp_url}"
+    def _save_index(self) -> None:
+        tmp_path = SNAPSHOT_INDEX_PATH.with_suffix(".json.tmp")
+        try:
+            tmp_path.write_text(json.dumps({self._camera_name: self._idx}))
+            os.replace(tmp_path, SNAPSHOT_INDEX_PATH)
+        except OSError as e:
+            log("snapshot", f"ERROR saving snapshot index: {e}")
 
-    except Exception as e:
-        log("snapshot", f"ERROR saving snapshot: {e}")
-        return None
+    def save(self, frame: np.ndarray, now: datetime) -> str | None:
+        """Encode the full frame and save it to /config/www/gate-monitor/, returning the /local/ path."""
+        try:
+            frame = cv2.resize(frame, FRAME_SIZE, interpolation=cv2.INTER_AREA)
+            image_data = encode_jpeg(frame, 85)
+
+            SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+
+            # Save into the next ring slot for history; unlink first so the
+            # overwrite gets a fresh inode instead of truncating one in use
+            slot = self._idx % self._history
+            snapshot_path = SNAPSHOT_DIR / f"{self._camera_name}_{slot:03d}.jpg"
+            snapshot_path.unlink(missing_ok=True)
+            write_file(snapshot_path, image_data)
+            self._idx += 1
+            self._save_index()
+
+            # Also expose as "latest" for easy access: hardlink the same bytes and swap
+            # it in atomically so HA never serves a partially written file
+            latest_path = SNAPSHOT_DIR / f"{self._camera_name}_latest.jpg"
+            tmp_path = latest_path.with_suffix(".jpg.tmp")
+            tmp_path.unlink(missing_ok=True)
+            try:
+                os.link(snapshot_path, tmp_path)
+            except OSError:
+                # No hardlinks on this filesystem: fall back to a second write
+                write_file(tmp_path, image_data)
+            os.replace(tmp_path, latest_path)
+
+            log("snapshot", f"Saved snapshot to {snapshot_path} (slot {slot + 1}/{self._history})")
+
+            # Return /local/ path for HA notifications (maps to /config/www/)
+            timestamp_url = int(now.timestamp())
+            return f"/local/gate-monitor/{self._camera_name}_latest.jpg?v={timestamp_url}"
+
+        except Exception as e:
+            log("snapshot", f"ERROR saving snapshot: {e}")
+            return None
 
 
 def parse_gate_response(response_text: str) -> tuple[str, int]:
@@ -402,10 +777,14 @@ def parse_gate_response(response_text: str) -> tuple[str, int]:
 
     # Try parsing as JSON first
     try:
-        # Strip markdown code fences if present
-        cleaned = re.sub(r'^```(?:json)?\s*', '', text, flags=re.MULTILINE)
-        cleaned = re.sub(r'\s*```$', '', cleaned, flags=re.MULTILINE)
-        cleaned = cleaned.strip()
+        if text.startswith("{") and text.endswith("}"):
+            # Common case: bare JSON object, nothing to strip
+            cleaned = text
+        else:
+            # Strip markdown code fences if present
+            cleaned = _FENCE_OPEN.sub('', text)
+            cleaned = _FENCE_CLOSE.sub('', cleaned)
+            cleaned = cleaned.strip()
 
         data = json.loads(cleaned)
         status = data.get("status", "UNKNOWN").upper()
@@ -417,7 +796,7 @@ def parse_gate_response(response_text: str) -> tuple[str, int]:
         pass
 
     # Fallback: look for JSON-like pattern in the text
-    json_match = re.search(r'\{[^}]*"status"\s*:\s*"(OPEN|CLOSED|UNKNOWN)"[^}]*\}', text, re.IGNORECASE)
+    json_match = _JSON_FALLBACK.search(text)
     if json_match:
         try:
             data = json.loads(json_match.group(0))
@@ -436,29 +815,54 @@ def parse_gate_response(response_text: str) -> tuple[str, int]:
     return "unknown", 0
 
 
-def build_contents(reference_images: list, query_image: Image.Image) -> list:
+def build_contents(reference_images: list, query_image: bytes) -> list:
     """Build the contents list for the Gemini API call.
 
+    Images are passed as JPEG byte parts so the SDK sends them as-is.
+
     Args:
-        reference_images: List of (label, PIL.Image) tuples
-        query_image: The current gate image to classify
+        reference_images: List of (label, JPEG bytes) tuples
+        query_image: JPEG bytes of the current gate image to classify
     """
     contents = []
 
     if reference_images:
         contents.append(VISION_PROMPT_WITH_REFS)
         # Add reference images as few-shot examples
-        for label, img in reference_images:
+        for label, image_data in reference_images:
             contents.append(label)
-            contents.append(img)
+            contents.append(types.Part.from_bytes(data=image_data, mime_type="image/jpeg"))
         contents.append("Now classify this image:")
     else:
         contents.append(VISION_PROMPT_NO_REFS)
 
-    contents.append(query_image)
+    contents.append(types.Part.from_bytes(data=query_image, mime_type="image/jpeg"))
     return contents
 
 
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter: ~1s, 2s, 4s... capped at BACKOFF_MAX_SECONDS."""
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) + random.uniform(0, BACKOFF_BASE_SECONDS)
+
+
+def retry_delay_seconds(error: errors.APIError) -> float | None:
+    """Return the retry delay the server suggested in a 429 error, if any.
+
+    Reads google.rpc.RetryInfo ("retryDelay": "37s") from the error details,
+    falling back to a "retry in 37.5s" hint in the message.
+    """
+    body = error.details if isinstance(error.details, dict) else {}
+    info = body.get("error", body)
+    for item in info.get("details", None) or []:
+        if isinstance(item, dict) and str(item.get("@type", "")).endswith("RetryInfo"):
+            match = _RETRY_DELAY.match(str(item.get("retryDelay", "")))
+            if match:
+                return float(match.group(1))
+
+    match = _RETRY_IN_MESSAGE.search(error.message or "")
+    return float(match.group(1)) if match else None
+
+
 def analyze_gate(
     client: genai.Client,
     models: list[str],
@@ -479,50 +883,74 @@ def analyze_gate(
         log("vision", "No Gemini 3.x models available, skipping API check")
         return "unavailable", 0, ""
 
-    query_image = Image.open(io.BytesIO(image_data))
-    contents = build_contents(reference_images, query_image)
+    contents = build_contents(reference_images, image_data)
 
-    for model_name in models:
-        log("vision", f"Analyzing image with {model_name}...")
+    for index, model_name in enumerate(models):
+        remaining = len(models) - index - 1
 
-        try:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=contents,
-                config=types.GenerateContentConfig(temperature=0.0),
-            )
+        for attempt in range(TRANSIENT_RETRIES + 1):
+            log("vision", f"Analyzing image with {model_name}...")
 
-            raw = response.text.strip()
-            log("vision", f"Gemini response: {raw}")
+            try:
+                response = client.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config=GENERATION_CONFIG,
+                )
 
-            status, confidence = parse_gate_response(raw)
-            log("vision", f"Parsed: status={status}, confidence={confidence}")
+                raw = response.text.strip()
+                log("vision", f"Gemini response: {raw}")
 
-            if confidence < confidence_threshold:
-                log("vision", f"Confidence {confidence} below threshold {confidence_threshold}, treating as unknown")
-                return "unknown", confidence, model_name
+                status, confidence = parse_gate_response(raw)
+                log("vision", f"Parsed: status={status}, confidence={confidence}")
 
-            return status, confidence, model_name
+                if confidence < confidence_threshold:
+                    log("vision", f"Confidence {confidence} below threshold {confidence_threshold}, treating as unknown")
+                    return "unknown", confidence, model_name
 
-        except Exception as e:
-            error_str = str(e)
-            is_rate_limit = "429" in error_str or "RESOURCE_EXHAUSTED" in error_str
-            is_transient = "503" in error_str or "UNAVAILABLE" in error_str or "504" in error_str or "Gateway Time-out" in error_str
-            is_not_found = "404" in error_str or "NOT_FOUND" in error_str
-            if is_rate_limit or is_transient or is_not_found:
-                reason = "Rate limited" if is_rate_limit else "Not found" if is_not_found else "Service unavailable"
-                remaining = len(models) - models.index(model_name) - 1
-                log("vision", f"{reason}: {model_name}. {remaining} fallback(s) remaining.")
-            else:
+                return status, confidence, model_name
+
+            except errors.APIError as e:
+                if e.code in TRANSIENT_ERROR_CODES and attempt < TRANSIENT_RETRIES:
+                    delay = backoff_delay(attempt)
+                    log("vision", f"Service unavailable ({e.code}): {model_name}. Retrying in {delay:.1f}s...")
+                    time.sleep(delay)
+                    continue
+
+                if e.code == 429 and attempt < TRANSIENT_RETRIES:
+                    delay = retry_delay_seconds(e)
+                    if delay is not None and delay <= RATE_LIMIT_MAX_WAIT_SECONDS:
+                        delay += random.uniform(0, BACKOFF_BASE_SECONDS)
+                        log("vision", f"Rate limited: {model_name}. Server asked to retry, waiting {delay:.1f}s...")
+                        time.sleep(delay)
+                        continue
+
+                if e.code == 429 or e.code == 404 or e.code in TRANSIENT_ERROR_CODES:
+                    reason = "Rate limited" if e.code == 429 else "Not found" if e.code == 404 else "Service unavailable"
+                    log("vision", f"{reason}: {model_name}. {remaining} fallback(s) remaining.")
+                    if e.code == 404:
+                        # Model list is stale; re-list models on next startup
+                        invalidate_model_cache()
+                    break
+
+                log("vision", f"ERROR: {model_name} failed: {e.code} {e.status}: {e.message}")
+                return "unavailable", 0, ""
+
+            except Exception as e:
                 log("vision", f"ERROR: {model_name} failed: {e}")
-                break
+                return "unavailable", 0, ""
 
     log("vision", "All 3.x models unavailable, returning safely")
     return "unavailable", 0, ""
 
 
-def create_mqtt_client(config: dict) -> mqtt.Client:
-    """Create and connect MQTT client."""
+def create_mqtt_client(config: dict, check_requests: queue.Queue) -> mqtt.Client:
+    """Create and connect MQTT client.
+
+    Registers a Last Will so the broker marks the add-on offline if the process
+    dies without disconnecting, and publishes "online" on every (re)connect.
+    Any message on {topic_prefix}/{camera_name}/trigger requests an immediate check.
+    """
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
 
     username = config.get("mqtt_username", "")
@@ -530,15 +958,49 @@ def create_mqtt_client(config: dict) -> mqtt.Client:
     if username:
         client.username_pw_set(username, password)
 
+    topic_prefix = config.get("mqtt_topic_prefix", "homeassistant/gate")
+    camera_name = config.get("camera_name", "exterior_frente")
+    trigger_topic = f"{topic_prefix}/{camera_name}/trigger"
+    client.will_set(f"{topic_prefix}/status", "offline", qos=1, retain=True)
+
+    def on_connect(client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            log("mqtt", f"ERROR: Connection refused: {reason_code}")
+            return
+        log("mqtt", "Connected to MQTT broker")
+        publish_addon_status(client, topic_prefix, "online")
+        client.subscribe(trigger_topic)
+
+    def on_trigger(client, userdata, message):
+        if message.retain:
+            # A retained trigger would be replayed on every (re)subscribe
+            log("mqtt", f"Ignoring retained message on {message.topic}")
+            return
+        log("mqtt", f"Check requested on {message.topic}")
+        try:
+            check_requests.put_nowait("MQTT trigger")
+        except queue.Full:
+            pass
+
+    client.on_connect = on_connect
+    client.message_callback_add(trigger_topic, on_trigger)
+
+    # Publishes only enqueue; let paho buffer through broker hiccups and
+    # reconnect quickly instead of backing off for minutes
+    client.max_inflight_messages_set(100)
+    client.max_queued_messages_set(1000)
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
+
     broker = config.get("mqtt_broker", "core-mosquitto")
     port = config.get("mqtt_port", 1883)
 
     log("mqtt", f"Connecting to MQTT broker {broker}:{port}...")
 
+    # Connect from the network thread so startup doesn't block on the broker;
+    # paho keeps retrying if it is not reachable yet
     try:
-        client.connect(broker, port, 60)
+        client.connect_async(broker, port, 60)
         client.loop_start()
-        log("mqtt", "Connected to MQTT broker")
     except Exception as e:
         log("mqtt", f"ERROR: Failed to connect: {e}")
 
@@ -546,33 +1008,51 @@ def create_mqtt_client(config: dict) -> mqtt.Client:
 
 
 def publish_status(client: mqtt.Client, topic_prefix: str, camera_name: str, status: str) -> None:
-    """Publish gate status to MQTT."""
+    """Publish gate status to MQTT (QoS 0, queued for the network thread, not awaited)."""
     topic = f"{topic_prefix}/{camera_name}/status"
-    client.publish(topic, status, retain=True)
+    client.publish(topic, status, qos=0, retain=True)
     log("mqtt", f"Published to {topic}: {status}")
 
 
-def publish_alert(client: mqtt.Client, topic_prefix: str, camera_name: str, snapshot_path: str | None) -> None:
-    """Publish gate open alert to MQTT with snapshot path."""
+def publish_alert(
+    client: mqtt.Client, topic_prefix: str, camera_name: str, snapshot_path: str | None, now: datetime
+) -> None:
+    """Publish gate open alert to MQTT with snapshot path, waiting for broker acknowledgement."""
     topic = f"{topic_prefix}/{camera_name}/alert"
 
     # Send JSON payload with snapshot path
     payload = {
         "event": "gate_open",
         "camera": camera_name,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": now.isoformat(),
         "snapshot": snapshot_path,
     }
 
-    client.publish(topic, json.dumps(payload))
+    msg_info = client.publish(topic, _dumps(payload), qos=1)
+    if not wait_for_publish(msg_info, "alert"):
+        return
     log("mqtt", f"Published alert to {topic} with snapshot: {snapshot_path}")
 
 
-def publish_addon_status(client: mqtt.Client, topic_prefix: str, status: str) -> None:
+def publish_addon_status(client: mqtt.Client, topic_prefix: str, status: str) -> mqtt.MQTTMessageInfo:
     """Publish add-on online/offline status."""
     topic = f"{topic_prefix}/status"
-    client.publish(topic, status, retain=True)
+    msg_info = client.publish(topic, status, qos=1, retain=True)
     log("mqtt", f"Add-on status: {status}")
+    return msg_info
+
+
+def wait_for_publish(msg_info: mqtt.MQTTMessageInfo, what: str) -> bool:
+    """Block until a QoS 1 publish is acknowledged or MQTT_PUBLISH_TIMEOUT expires."""
+    try:
+        msg_info.wait_for_publish(timeout=MQTT_PUBLISH_TIMEOUT)
+    except (RuntimeError, ValueError) as e:
+        log("mqtt", f"ERROR: Failed to publish {what}: {e}")
+        return False
+    if not msg_info.is_published():
+        log("mqtt", f"ERROR: Timed out publishing {what} after {MQTT_PUBLISH_TIMEOUT}s")
+        return False
+    return True
 
 
 def main() -> None:
@@ -595,56 +1075,100 @@ def main() -> None:
     topic_prefix = config.get("mqtt_topic_prefix", "homeassistant/gate")
     check_interval = config.get("check_interval_minutes", 30) * 60
     confidence_threshold = config.get("confidence_threshold", 70)
+    motion_detection = config.get("motion_detection", True)
+    motion_cooldown = config.get("motion_cooldown_minutes", 5) * 60
 
     log("main", f"Camera: {camera_name}")
     ssim_threshold = config.get("ssim_threshold", SSIM_THRESHOLD)
+    scene_change_threshold = config.get("scene_change_threshold", SCENE_CHANGE_THRESHOLD)
 
     log("main", f"Check interval: {check_interval // 60} minutes")
+    if motion_detection:
+        log("main", f"Motion-triggered checks: on (cooldown {motion_cooldown // 60} minutes)")
     log("main", f"Confidence threshold: {confidence_threshold}%")
     log("main", f"SSIM threshold: {ssim_threshold}")
+    log("main", f"Scene change threshold: {scene_change_threshold}")
     log("main", f"Min model version: {MIN_MODEL_VERSION}")
+    log("main", f"JPEG encoder: {'libjpeg-turbo (PyTurboJPEG)' if _turbojpeg is not None else 'OpenCV'}")
+
+    # Start the persistent RTSP reader, preferring the low-resolution sub-stream.
+    # It becomes the only frame source: alert snapshots come from it too, and
+    # GATE_CROP (fractional) assumes it shows the same view as the main stream.
+    substream_url = config.get("rtsp_substream_url", "")
+    if substream_url:
+        log("main", "Using RTSP sub-stream for capture (alert snapshots included)")
+    check_requests = queue.Queue(maxsize=1)
+    capture = RTSPCapture(
+        substream_url or rtsp_url,
+        check_requests if motion_detection else None,
+        motion_cooldown,
+    )
+    capture.start()
+
+    snapshotter = Snapshotter(camera_name, config.get("snapshot_history", SNAPSHOT_HISTORY))
+
+    # Initialize MQTT (connects in paho's network thread)
+    mqtt_client = create_mqtt_client(config, check_requests)
 
     # Initialize Gemini client
     gemini_client = genai.Client(api_key=api_key)
 
     # Find available 3.x+ models
-    available_models = find_available_models(gemini_client)
+    available_models = find_available_models(gemini_client, model_cache_key(api_key))
     if available_models:
         log("main", f"Primary model: {available_models[0]} ({len(available_models)} available)")
     else:
         log("main", "WARNING: No 3.x models found. Running in local-only mode.")
 
-    # Load reference images (PIL for Gemini, OpenCV for SSIM)
+    # Load reference images (JPEG bytes for Gemini, OpenCV for SSIM)
     reference_images = load_reference_images()
     has_cv_refs = any(v is not None for v in reference_images["cv"].values())
 
     if not has_cv_refs:
         log("main", "WARNING: No reference images for local comparison. All checks will use API.")
 
-    # Initialize MQTT
-    mqtt_client = create_mqtt_client(config)
-    publish_addon_status(mqtt_client, topic_prefix, "online")
+    # Model discovery and reference loading ran while MQTT and RTSP connected
+    # in their background threads; only wait for whatever the broker still needs
+    deadline = time.monotonic() + MQTT_CONNECT_TIMEOUT
+    while not mqtt_client.is_connected() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if not mqtt_client.is_connected():
+        log("main", f"WARNING: MQTT not connected after {MQTT_CONNECT_TIMEOUT}s, continuing (paho keeps retrying)")
 
-    time.sleep(5)
+    # Thumbnail and result of the last check that was actually analyzed
+    last_thumb = None
+    last_status, last_confidence, last_method = "unknown", 0, "none"
+
+    # Supervisor stops the add-on with SIGTERM; exit the wait immediately and clean up
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     try:
         while True:
             log("main", "Starting gate check...")
 
-            full_frame, gate_crop, gate_crop_bgr = capture_rtsp_frame(rtsp_url)
+            full_frame, gate_crop, gate_crop_bgr = capture_rtsp_frame(capture)
 
             if full_frame is None:
                 log("main", "Skipping analysis due to capture failure")
                 log("main", f"Next check in {check_interval // 60} minutes")
-                time.sleep(check_interval)
+                wait_for_check(check_requests, check_interval)
                 continue
 
             status = "unknown"
             confidence = 0
             method = "none"
 
+            # Layer 0: Scene unchanged since last conclusive check — reuse its result
+            thumb = scene_thumbnail(gate_crop_bgr)
+            unchanged = last_status in ("open", "closed") and is_scene_unchanged(thumb, last_thumb, scene_change_threshold)
+            if unchanged:
+                status = last_status
+                confidence = last_confidence
+                method = f"unchanged ({last_method})"
+                log("main", f"Scene unchanged, reusing last status: {status}")
+
             # Layer 1: Local SSIM comparison
-            if has_cv_refs:
+            elif has_cv_refs:
                 local_status, local_score = compare_local(gate_crop_bgr, reference_images["cv"], ssim_threshold)
 
                 if local_status == "closed":
@@ -659,7 +1183,7 @@ def main() -> None:
                     log("main", f"Local: possible OPEN (SSIM {local_score:.3f}), confirming with Gemini...")
                     api_status, api_confidence, model_used = analyze_gate(
                         gemini_client, available_models, gate_crop,
-                        reference_images["pil"], confidence_threshold,
+                        reference_images["jpeg"], confidence_threshold,
                     )
                     if api_status in ("open", "closed"):
                         status = api_status
@@ -680,7 +1204,7 @@ def main() -> None:
                     log("main", "Local inconclusive, asking Gemini 3.x...")
                     api_status, api_confidence, model_used = analyze_gate(
                         gemini_client, available_models, gate_crop,
-                        reference_images["pil"], confidence_threshold,
+                        reference_images["jpeg"], confidence_threshold,
                     )
                     if api_status == "unavailable":
                         status = "unknown"
@@ -693,7 +1217,7 @@ def main() -> None:
                 # No reference images — API only
                 api_status, api_confidence, model_used = analyze_gate(
                     gemini_client, available_models, gate_crop,
-                    reference_images["pil"], confidence_threshold,
+                    reference_images["jpeg"], confidence_threshold,
                 )
                 if api_status == "unavailable":
                     status = "unknown"
@@ -703,23 +1227,34 @@ def main() -> None:
                     confidence = api_confidence
                     method = model_used
 
+            if not unchanged:
+                last_thumb = thumb
+                last_status, last_confidence, last_method = status, confidence, method
+
             # Publish result
             publish_status(mqtt_client, topic_prefix, camera_name, status)
 
             if status == "open":
-                snapshot_path = save_snapshot(full_frame, camera_name)
-                publish_alert(mqtt_client, topic_prefix, camera_name, snapshot_path)
+                # One clock read so the alert timestamp and snapshot cache-buster agree
+                now = datetime.now()
+                snapshot_path = snapshotter.save(full_frame, now)
+                publish_alert(mqtt_client, topic_prefix, camera_name, snapshot_path, now)
                 log("main", f"GATE IS OPEN - Alert sent [{method}] (confidence: {confidence}%)")
             else:
                 log("main", f"Gate status: {status} [{method}] (confidence: {confidence}%)")
 
-            log("main", f"Next check in {check_interval // 60} minutes")
-            time.sleep(check_interval)
+            log("main", f"Next check in {check_interval // 60} minutes{' (or on motion)' if motion_detection else ''}")
+            reason = wait_for_check(check_requests, check_interval)
+            if reason != "interval":
+                log("main", f"Check triggered by {reason}")
 
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, SystemExit):
         log("main", "Shutting down...")
     finally:
-        publish_addon_status(mqtt_client, topic_prefix, "offline")
+        capture.stop()
+        # A clean disconnect does not trigger the Last Will, so announce it here
+        # and let it reach the broker before the network loop is stopped
+        wait_for_publish(publish_addon_status(mqtt_client, topic_prefix, "offline"), "offline status")
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
         log("main", "Goodbye!")